@@ -7,7 +7,7 @@
 
 from abc import ABCMeta, abstractmethod
 from random import expovariate
-from typing import Dict, Optional, Tuple
+from typing import List, Optional
 
 
 class LatencyPolicy(metaclass=ABCMeta):
@@ -19,40 +19,73 @@ class LatencyPolicy(metaclass=ABCMeta):
 class StaticLatencyPolicy(LatencyPolicy):
     def __init__(self, base_delay: float = 0.0):
         self.base_delay = base_delay
-        self.node2node_delays: Dict[Tuple[int, int], float] = {}
+        self.node2node_delays: List[List[Optional[float]]] = []
 
     def set_delay(self, src_node: int, dst_node: int, delay: Optional[float]):
-        if delay is None:
-            self.node2node_delays.pop((src_node, dst_node), None)
-        else:
-            self.node2node_delays[(src_node, dst_node)] = delay
+        _set_pair_value(self.node2node_delays, src_node, dst_node, delay)
 
     def get_delay(self, src_node: int, dst_node: int) -> float:
-        if (src_node, dst_node) in self.node2node_delays:
-            return self.node2node_delays[(src_node, dst_node)]
-        return self.base_delay
+        delay = _get_pair_value(self.node2node_delays, src_node, dst_node)
+        if delay is None:
+            return self.base_delay
+        return delay
 
 
 class ExponentiallyDistributedLatencyPolicy(LatencyPolicy):
     def __init__(self, avg_delay: float = 0.0):
         self.avg_delay = avg_delay
-        self.node2node_avg_delays: Dict[Tuple[int, int], float] = {}
+        self.node2node_avg_delays: List[List[Optional[float]]] = []
 
     def set_avg_delay(
             self, src_node: int, dst_node: int, avg_delay: Optional[float]
     ):
-        if avg_delay is None:
-            self.node2node_avg_delays.pop((src_node, dst_node), None)
-        else:
-            self.node2node_avg_delays[(src_node, dst_node)] = avg_delay
+        _set_pair_value(self.node2node_avg_delays, src_node, dst_node, avg_delay)
 
     def get_delay(self, src_node: int, dst_node: int) -> float:
-        if (src_node, dst_node) in self.node2node_avg_delays:
-            avg_delay = self.node2node_avg_delays[(src_node, dst_node)]
-        else:
+        avg_delay = _get_pair_value(self.node2node_avg_delays, src_node, dst_node)
+        if avg_delay is None:
             avg_delay = self.avg_delay
 
         if avg_delay == 0.0:
             return 0.0
 
         return expovariate(1.0 / avg_delay)
+
+
+def _set_pair_value(
+        table: List[List[Optional[float]]],
+        src_node: int,
+        dst_node: int,
+        value: Optional[float]
+):
+    """
+    Per-pair values are stored in rows indexed by the source node, and columns
+    indexed by the destination node. This is cheaper to query than a dict
+    indexed by tuples, as we don't have to build & hash a tuple per lookup.
+    Rows grow on demand, missing values are represented by None.
+    """
+    if src_node < 0 or dst_node < 0:
+        raise ValueError('Node indices must be non-negative')
+
+    if value is None and _get_pair_value(table, src_node, dst_node) is None:
+        return  # Nothing to remove, no need to grow the table
+
+    if len(table) <= src_node:
+        table.extend([] for _ in range(src_node + 1 - len(table)))
+    row = table[src_node]
+    if len(row) <= dst_node:
+        row.extend([None] * (dst_node + 1 - len(row)))
+    row[dst_node] = value
+
+
+def _get_pair_value(
+        table: List[List[Optional[float]]],
+        src_node: int,
+        dst_node: int
+) -> Optional[float]:
+    # Negative indices would silently read other nodes' values
+    if 0 <= src_node < len(table):
+        row = table[src_node]
+        if 0 <= dst_node < len(row):
+            return row[dst_node]
+    return None
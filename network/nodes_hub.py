@@ -5,21 +5,28 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 
+from abc import ABCMeta, abstractmethod
 from asyncio import (
     AbstractEventLoop,
     AbstractServer,
+    Event,
+    Lock,
     Protocol,
+    Task,
     Transport,
     WriteTransport,
     gather,
     sleep as asyncio_sleep
 )
-from logging import getLogger
+from collections import deque
+from hashlib import sha256 as _sha256
+from logging import DEBUG, getLogger
 from socket import socket as socket_cls
-from struct import pack, unpack
+from struct import Struct
 from time import time as _time
 from typing import (
     Callable,
+    Deque,
     Dict,
     List,
     Optional,
@@ -30,8 +37,10 @@ from typing import (
 
 from network.latencies import LatencyPolicy
 from network.utils import get_pid_for_network_client
-from network.stats import NetworkStatsCollector
-from test_framework.messages import hash256
+from network.stats import (
+    NetworkStatsCollector,
+    NullNetworkStatsCollector
+)
 from test_framework.test_node import TestNode
 from test_framework.util import (
     p2p_port,
@@ -44,6 +53,19 @@ NUM_INBOUND_CONNECTIONS = 125
 MSG_HEADER_LENGTH = 4 + 12 + 4 + 4
 VERSION_PORT_OFFSET = 4 + 8 + 8 + 26 + 8 + 16
 
+# Pre-compiled formats, used to parse & rewrite messages without allocating
+_HDR_COMMAND_AND_LEN = Struct('<12sI')  # Skipping the network magic
+_PORT = Struct('!H')
+_CHECKSUM = Struct('4s')  # Truncates the digests to their 4 first bytes
+
+# Commands are stored in 12 bytes fields, padded with null bytes
+_VERSION_CMD = b'version' + b'\x00' * 5
+
+# Maps padded command fields to command names, to avoid splitting them for
+# every message. It's bounded in case we receive garbage.
+_COMMAND_NAMES: Dict[bytes, bytes] = {}
+_MAX_COMMAND_NAMES = 256
+
 
 logger = getLogger('TestFramework.nodes_hub')
 
@@ -85,8 +107,25 @@ class NodesHub:
 
         self.host = host
 
+        # Ports & addresses are computed only once, as we need them every time
+        # a connection is established or a 'version' message is relayed.
+        self.p2p_node_ports: List[int] = [
+            p2p_port(node_idx) for node_idx in range(len(nodes))
+        ]
+        self.p2p_proxy_ports: List[int] = [
+            p2p_port(len(nodes) + 1 + node_idx) for node_idx in range(len(nodes))
+        ]
+        self.proxy_addresses: List[str] = [
+            f'{host}:{proxy_port}' for proxy_port in self.p2p_proxy_ports
+        ]
+
         self.proxy_servers: List[AbstractServer] = []
-        self.ports2nodes_map: Dict[int, int] = {}
+        # Created lazily, so it's bound to the loop running our coroutines
+        self.proxies_started: Optional[Event] = None
+        # Nodes & proxies ports are contiguous, so we index them by their
+        # offset from the first one instead of using a dict.
+        self.ports_base = p2p_port(0)
+        self.ports2nodes_map: List[int] = [-1] * (2 * len(nodes) + 2)
 
         self.pending_connections: Set[Tuple[int, int]] = set()
         self.state = 'constructed'
@@ -94,8 +133,15 @@ class NodesHub:
         self.num_connection_intents = 0
         self.num_unexpected_connections = 0
         self.tried_connections: Set[Tuple[int, int]] = set()
+        # Used to serialize the (blocking) RPC calls made to the same node
+        self.rpc_locks: Dict[int, Lock] = {}
 
         self.network_stats_collector = network_stats_collector
+        # When we don't collect stats, we only have to inspect the messages that
+        # come before 'version' (included).
+        self.inspect_all_messages = not isinstance(
+            network_stats_collector, NullNetworkStatsCollector
+        )
 
     def sync_start_proxies(self, node_ids: Optional[List[int]] = None):
         """Sync wrapper around start_proxies"""
@@ -116,8 +162,8 @@ class NodesHub:
             node_ids = list(range(len(self.nodes)))
 
         for node_id in node_ids:
-            self.ports2nodes_map[self.get_p2p_node_port(node_id)] = node_id
-            self.ports2nodes_map[self.get_p2p_proxy_port(node_id)] = node_id
+            self.ports2nodes_map[self.p2p_node_ports[node_id] - self.ports_base] = node_id
+            self.ports2nodes_map[self.p2p_proxy_ports[node_id] - self.ports_base] = node_id
 
         self.proxy_servers = await gather(*[
             self.loop.create_server(
@@ -125,12 +171,13 @@ class NodesHub:
                     hub_ref=self, node_id=node_id
                 ),
                 host=self.host,
-                port=self.get_p2p_proxy_port(node_id)
+                port=self.p2p_proxy_ports[node_id]
             )
             for node_id in node_ids
         ])
 
         self.state = 'started_proxies'
+        self.get_proxies_started_event().set()
         logger.info('Started node proxies')
 
     def sync_biconnect_nodes_as_linked_list(self, nodes_list=None):
@@ -206,10 +253,10 @@ class NodesHub:
         return p2p_port(node_idx)
 
     def get_p2p_proxy_port(self, node_idx):
-        return p2p_port(len(self.nodes) + 1 + node_idx)
+        return self.p2p_proxy_ports[node_idx]
 
     def get_proxy_address(self, node_idx):
-        return f'{self.host}:{self.get_p2p_proxy_port(node_idx)}'
+        return self.proxy_addresses[node_idx]
 
     async def connect_nodes(
         self,
@@ -227,8 +274,8 @@ class NodesHub:
             num_expected_proxies = len(self.nodes)
 
         # We have to wait until all the proxies are configured and listening
-        while len(self.proxy_servers) < num_expected_proxies:
-            await asyncio_sleep(0)
+        if len(self.proxy_servers) < num_expected_proxies:
+            await self.get_proxies_started_event().wait()
 
         await self.connect_sender_to_proxy(outbound_idx, inbound_idx)
 
@@ -241,26 +288,47 @@ class NodesHub:
         """
 
         sender_node = self.nodes[outbound_idx]
-        proxy_address = self.get_proxy_address(inbound_idx)
+        proxy_address = self.proxy_addresses[inbound_idx]
         retry = retry or (outbound_idx, inbound_idx) in self.tried_connections
 
         # self.pending_connections is used as a sort of semaphore
         if not retry:
             self.pending_connections.add((outbound_idx, inbound_idx))
-            # Add the proxy to the outgoing connections list
-            try:
-                sender_node.addnode(proxy_address, 'add')
-            except BaseException as e:
-                if str(e) == 'Error: Node already added (-23)':
-                    pass
-                else:
-                    raise e
-            finally:
-                self.num_connection_intents += 1
-                self.tried_connections.add((outbound_idx, inbound_idx))
-
-        # Connect to proxy. Will trigger ProxyInputConnection.connection_made
-        sender_node.addnode(proxy_address, 'onetry')
+
+        # The RPC calls are blocking, so we run them in the loop's executor. This
+        # allows establishing many connections concurrently, and relaying the
+        # handshake messages in the meantime. The calls made to the same node
+        # are serialized, as its RPC client is not thread-safe.
+        async with self.get_rpc_lock(outbound_idx):
+            if not retry:
+                # Add the proxy to the outgoing connections list
+                try:
+                    await self.loop.run_in_executor(
+                        None, sender_node.addnode, proxy_address, 'add'
+                    )
+                except BaseException as e:
+                    if str(e) == 'Error: Node already added (-23)':
+                        pass
+                    else:
+                        raise e
+                finally:
+                    self.num_connection_intents += 1
+                    self.tried_connections.add((outbound_idx, inbound_idx))
+
+            # Connect to proxy. Will trigger ProxyInputConnection.connection_made
+            await self.loop.run_in_executor(
+                None, sender_node.addnode, proxy_address, 'onetry'
+            )
+
+    def get_rpc_lock(self, node_idx: int) -> Lock:
+        if node_idx not in self.rpc_locks:
+            self.rpc_locks[node_idx] = Lock()
+        return self.rpc_locks[node_idx]
+
+    def get_proxies_started_event(self) -> Event:
+        if self.proxies_started is None:
+            self.proxies_started = Event()
+        return self.proxies_started
 
     async def wait_for_pending_connections(
         self,
@@ -285,15 +353,16 @@ class NodesHub:
                 break
 
             logger.debug(
-                'Remaining connections to be fully established: '
-                f'{len(self.pending_connections)} '
+                'Remaining connections to be fully established: %d',
+                len(self.pending_connections)
             )
 
-            # We retry becase the 'onetry' RPC call not always succeed
-            for outbound_idx, inbound_idx in self.pending_connections:
-                await self.connect_sender_to_proxy(
-                    outbound_idx, inbound_idx, retry=True
-                )
+            # We retry becase the 'onetry' RPC call not always succeed. We copy
+            # the set because it's modified when the connections are established.
+            await gather(*(
+                self.connect_sender_to_proxy(outbound_idx, inbound_idx, retry=True)
+                for outbound_idx, inbound_idx in list(self.pending_connections)
+            ))
 
             await asyncio_sleep(0.005)
 
@@ -309,61 +378,138 @@ class NodesHub:
 
     def process_buffer(
             self,
-            buffer: bytes,
+            buffer: Union[bytes, bytearray],
             transport: WriteTransport,
             connection: Union['ProxyInputConnection', 'ProxyOutputConnection']
-    ) -> bytes:
+    ) -> bytearray:
         """
         This function helps the hub to impersonate nodes by modifying 'version'
         messages changing the "from" addresses.
+
+        It returns what remains after parsing all the complete messages (the
+        beginning of a not yet complete message). 'version' messages are
+        rewritten in place, and all the messages are passed to the transport as
+        views of the buffer, so whenever something has been consumed the
+        remainder is returned in a new bytearray, and the original one must not
+        be modified anymore.
+
+        When nothing is pending, the received data can be passed directly
+        (as bytes), to avoid copying it into the connection's buffer.
         """
 
+        buffer_len = len(buffer)
+
+        # We already know that the first message is not yet complete
+        if buffer_len < connection.pending_msg_length:
+            return buffer if isinstance(buffer, bytearray) else bytearray(buffer)
+
+        buffer_view = memoryview(buffer)
+        pos = 0
+        pending_msg_length = 0
+        debug_on = logger.isEnabledFor(DEBUG)
+
+        # We send all the processed messages at once, to save system calls
+        output_chunks: List[memoryview] = []
+
+        # This loop runs once per relayed message, so we avoid repeating the
+        # same attribute lookups in every iteration.
+        unpack_header = _HDR_COMMAND_AND_LEN.unpack_from
+        get_command_name = _COMMAND_NAMES.get
+        register_p2p_command = self.register_p2p_command
+        append_output_chunk = output_chunks.append
+
         # We do nothing until we have (magic + command + length + checksum)
-        while len(buffer) > MSG_HEADER_LENGTH:
+        while buffer_len - pos >= MSG_HEADER_LENGTH:
 
             # We only care about command & msglen
-            msglen = unpack("<i", buffer[4 + 12:4 + 12 + 4])[0]
+            command_field, msglen = unpack_header(buffer_view, pos + 4)
+            frame_end = pos + MSG_HEADER_LENGTH + msglen
 
-            # We wait until we have the full message
-            if len(buffer) < MSG_HEADER_LENGTH + msglen:
-                return buffer
+            # We wait until we have the full message, remembering its length to
+            # avoid parsing its header again for every received chunk.
+            if buffer_len < frame_end:
+                pending_msg_length = MSG_HEADER_LENGTH + msglen
+                break
 
-            command = buffer[4:4 + 12].split(b'\x00', 1)[0]
-            logger.debug(
-                f'{connection.__class__.__name__} {connection.id}: '
-                f'Processing command {str(command)}'
-            )
+            command = get_command_name(command_field)
+            if command is None:
+                command = command_field.split(b'\x00', 1)[0]
+                if len(_COMMAND_NAMES) < _MAX_COMMAND_NAMES:
+                    _COMMAND_NAMES[command_field] = command
 
-            self.register_p2p_command(command, connection, MSG_HEADER_LENGTH + msglen)
+            if debug_on:
+                logger.debug(
+                    '%s %s: Processing command %s',
+                    connection.__class__.__name__, connection.id, command
+                )
 
-            if b'version' == command:
-                msg = buffer[MSG_HEADER_LENGTH:MSG_HEADER_LENGTH + msglen]
+            register_p2p_command(command, connection, MSG_HEADER_LENGTH + msglen)
 
-                node_port: int = unpack(
-                    '!H', msg[VERSION_PORT_OFFSET:VERSION_PORT_OFFSET + 2]
-                )[0]
-                if node_port != 0:
-                    proxy_port = self.get_p2p_proxy_port(
-                        self.ports2nodes_map[node_port]
-                    )
-                    msg = (
-                        msg[:VERSION_PORT_OFFSET] +
-                        pack('!H', proxy_port) +
-                        msg[VERSION_PORT_OFFSET + 2:]
-                    )
-                    msg_checksum = hash256(msg)[:4]  # Truncated double sha256
-                    new_header = buffer[:MSG_HEADER_LENGTH - 4] + msg_checksum
+            # Unless it's a 'version' one, we pass an unaltered message
+            frame_view = buffer_view[pos:frame_end]
+            if _VERSION_CMD == command_field:
+                connection.version_relayed = True
+                if frame_view.readonly:
+                    # We can't modify the received data, so we copy the message
+                    frame_view = memoryview(bytearray(frame_view))
+                self.rewrite_version_port(frame_view, msglen)
+
+            append_output_chunk(frame_view)
 
-                    transport.write(new_header + msg)
-                else:
-                    transport.write(buffer[:MSG_HEADER_LENGTH + msglen])
-            else:
-                # We pass an unaltered message
-                transport.write(buffer[:MSG_HEADER_LENGTH + msglen])
+            pos = frame_end
+
+        connection.pending_msg_length = pending_msg_length
+
+        # There's nothing else to rewrite after the 'version' message, so if we
+        # don't have to collect stats we can stop parsing the received data.
+        if (
+            connection.version_relayed and
+            buffer_len == pos and
+            not self.inspect_all_messages
+        ):
+            connection.relay_raw_data = True
 
-            buffer = buffer[MSG_HEADER_LENGTH + msglen:]
+        if 0 == pos:
+            return buffer if isinstance(buffer, bytearray) else bytearray(buffer)
 
-        return buffer
+        transport.writelines(output_chunks)
+        return bytearray(buffer_view[pos:])
+
+    def rewrite_version_port(self, frame_view: memoryview, msglen: int):
+        """
+        Modifies in place the 'version' message (header included) viewed by
+        frame_view, replacing the node's port by its proxy's port.
+        """
+        if msglen < VERSION_PORT_OFFSET + 2:
+            return  # Malformed message, we don't touch it
+
+        port_offset = MSG_HEADER_LENGTH + VERSION_PORT_OFFSET
+
+        node_port: int = _PORT.unpack_from(frame_view, port_offset)[0]
+        if node_port == 0:
+            return  # The node is not listening, nothing to impersonate
+
+        port_idx = node_port - self.ports_base
+        node_id = (
+            self.ports2nodes_map[port_idx]
+            if 0 <= port_idx < len(self.ports2nodes_map) else -1
+        )
+        if node_id < 0:
+            # Malformed message or unknown node, we pass it unaltered
+            logger.warning('Received version message with unknown port %s', node_port)
+            return
+
+        proxy_port = self.p2p_proxy_ports[node_id]
+
+        # Only the port and the checksum (truncated double sha256) change. The
+        # payload is hashed directly from the frame, without copying it.
+        # Caching the hash state of the payload's prefix wouldn't help: it's
+        # just ~1 sha256 block, and it contains the timestamp and addr_recv
+        # fields, so it's different for every 'version' message.
+        _PORT.pack_into(frame_view, port_offset, proxy_port)
+        _CHECKSUM.pack_into(frame_view, MSG_HEADER_LENGTH - 4, _sha256(
+            _sha256(frame_view[MSG_HEADER_LENGTH:]).digest()
+        ).digest())
 
     def register_p2p_command(
             self,
@@ -393,27 +539,123 @@ class NodesHub:
         )
 
 
-class ProxyInputConnection(Protocol):
+class ProxyConnection(Protocol, metaclass=ABCMeta):
+    """
+    Common logic of the proxy connections: it relays the received data to the
+    other side of the proxy, after the latency policy's delay.
+
+    Subclasses must set self.transport, and provide the transport where the
+    received data has to be written (get_output_transport).
+    """
+    def __init__(self, hub_ref: NodesHub):
+        self.hub_ref = hub_ref
+        self.transport: Optional[Transport] = None
+
+        self.recvbuf = bytearray()
+        # Length of the (incomplete) message at the beginning of recvbuf
+        self.pending_msg_length = 0
+        # See NodesHub.process_buffer
+        self.version_relayed = False
+        self.relay_raw_data = False
+
+        # Received chunks waiting to be relayed, with their deadlines
+        self.pending_chunks: Deque[Tuple[float, bytes]] = deque()
+        self.relay_deadline = 0.0
+        self.relay_task: Optional[Task] = None
+
+        # Debugging related properties:
+        self.id = hex(id(self))
+
+    @abstractmethod
+    def get_output_transport(self) -> Transport:
+        raise NotImplementedError
+
+    def is_output_ready(self) -> bool:
+        return True
+
+    async def wait_for_output(self):
+        pass
+
+    def relay_data(self, data: bytes, delay: float):
+        # We only defer the processing when it's really necessary, and we never
+        # process data inline while older data is still waiting (to preserve
+        # the messages' order).
+        if 0 == delay and not self.pending_chunks and self.is_output_ready():
+            self.__process_received_data((data,))
+            return
+
+        # Chunks are relayed in FIFO order, so they can't overtake the ones that
+        # were received before them, even if their delay is shorter.
+        self.relay_deadline = max(
+            self.relay_deadline, self.hub_ref.loop.time() + delay
+        )
+        self.pending_chunks.append((self.relay_deadline, data))
+        if self.relay_task is None:
+            self.relay_task = self.hub_ref.loop.create_task(
+                self.__relay_pending_chunks()
+            )
+
+    async def __relay_pending_chunks(self):
+        try:
+            if not self.is_output_ready():
+                await self.wait_for_output()
+
+            while self.pending_chunks:
+                delay = self.pending_chunks[0][0] - self.hub_ref.loop.time()
+                if delay > 0:
+                    await asyncio_sleep(delay)
+
+                # We relay at once all the chunks whose deadline has passed
+                now = self.hub_ref.loop.time()
+                chunks = [self.pending_chunks.popleft()[1]]
+                while self.pending_chunks and self.pending_chunks[0][0] <= now:
+                    chunks.append(self.pending_chunks.popleft()[1])
+
+                self.__process_received_data(chunks)
+        finally:
+            self.relay_task = None
+
+    def __process_received_data(self, chunks):
+        transport = self.get_output_transport()
+
+        if self.relay_raw_data:
+            transport.writelines(chunks)
+            return
+
+        if not self.recvbuf and 1 == len(chunks):
+            # Nothing is pending, we parse the received data without copying it
+            buffer = chunks[0]
+        else:
+            for chunk in chunks:
+                self.recvbuf.extend(chunk)
+            buffer = self.recvbuf
+
+        self.recvbuf = self.hub_ref.process_buffer(
+            buffer=buffer,
+            transport=transport,
+            connection=self
+        )
+
+
+class ProxyInputConnection(ProxyConnection):
     """
     Represents connections made from nodes to node's proxies
     """
     def __init__(self, hub_ref: NodesHub, node_id: int):
-        self.hub_ref = hub_ref
+        super().__init__(hub_ref)
         self.receiver_id = node_id
 
         self.sender_id: Optional[int] = None
 
-        self.transport: Optional[Transport] = None
         self.output_connection: Optional[ProxyOutputConnection] = None
-
-        self.recvbuf = b''
+        # Set once output_connection has its own transport
+        self.output_ready = Event()
 
         # Debugging related properties:
-        self.id = hex(id(self))
         self.received_data_before_init = False
 
         logger.debug(
-            f'ProxyInputConnection {self.id}: __init__ (receiver_id={node_id})'
+            'ProxyInputConnection %s: __init__ (receiver_id=%s)', self.id, node_id
         )
 
     @classmethod
@@ -427,10 +669,10 @@ class ProxyInputConnection(Protocol):
     def connection_made(self, transport):
 
         try:
-            transport_socket: socket_cls = transport._sock
+            transport_socket: socket_cls = transport.get_extra_info('socket')
             peer_port = transport_socket.getpeername()[1]
             server_port = transport_socket.getsockname()[1]
-            assert server_port == self.hub_ref.get_p2p_proxy_port(self.receiver_id)
+            assert server_port == self.hub_ref.p2p_proxy_ports[self.receiver_id]
 
             peer_pid = get_pid_for_network_client(
                 client_port=peer_port,
@@ -441,9 +683,8 @@ class ProxyInputConnection(Protocol):
             # We wait until ProxyOutputConnection is created to remove pair from
             # self.nodes_hub.pending_connections
         except AttributeError:
-            # If this happens (theoretically possible due to the fact that we
-            # are accessing a "protected" property, we'll have to change how we
-            # obtain the socket.
+            # If this happens (the event loop's transports might not expose
+            # their sockets), we'll have to change how we obtain the socket.
             logger.critical('Unable to obtain socket from transport')
             exit(-1)
 
@@ -461,13 +702,13 @@ class ProxyInputConnection(Protocol):
                 input_connection=self
             ),
             host=self.hub_ref.host,
-            port=self.hub_ref.get_p2p_node_port(self.receiver_id)
+            port=self.hub_ref.p2p_node_ports[self.receiver_id]
         ))
 
-        logger.debug(f'''ProxyInputConnection {self.id}: connection_made {(
-            self.sender_id,
-            self.receiver_id
-        )}''')
+        logger.debug(
+            'ProxyInputConnection %s: connection_made (%s, %s)',
+            self.id, self.sender_id, self.receiver_id
+        )
 
     def connection_lost(self, exc):
         if self.transport is not None:
@@ -484,57 +725,50 @@ class ProxyInputConnection(Protocol):
                 f'ProxyInputConnection {self.id}: connection_lost (too early)'
             )
 
-        logger.debug(f'''ProxyInputConnection {self.id}: connection_lost {(
-            self.sender_id,
-            self.receiver_id
-        )}''')
+        logger.debug(
+            'ProxyInputConnection %s: connection_lost (%s, %s)',
+            self.id, self.sender_id, self.receiver_id
+        )
 
     def data_received(self, data):
-        self.hub_ref.loop.create_task(self.__handle_received_data(data))
+        logger.debug(
+            'ProxyInputConnection %s: (%s, %s) received %d bytes',
+            self.id, self.sender_id, self.receiver_id, len(data)
+        )
 
-    async def __handle_received_data(self, data):
-        while (
-            self.output_connection is None or
-            self.output_connection.transport is None
-        ):
-            self.received_data_before_init = True
-            if self.output_connection is None:
-                logger.debug(
-                    f'ProxyInputConnection {self.id}: Received data before '
-                    'being able to handle it. (output_connection is None)'
-                )
-            else:
-                logger.debug(
-                    f'ProxyInputConnection {self.id}: Received data before '
-                    'being able to handle it. (transport is None)'
-                )
-            await asyncio_sleep(0.0005)
+        delay = self.hub_ref.latency_policy.get_delay(
+            self.sender_id, self.receiver_id
+        )
 
-        if self.received_data_before_init:
-            logger.debug(
-                f'ProxyInputConnection {self.id}: '
-                'Initialized output_connection & transport'
-            )
-            self.received_data_before_init = False
+        self.relay_data(data, delay)
 
-        await asyncio_sleep(self.hub_ref.latency_policy.get_delay(
-            self.sender_id, self.receiver_id
-        ))
+    def get_output_transport(self) -> Transport:
+        # Only called once output_ready is set
+        assert self.output_connection is not None
+        assert self.output_connection.transport is not None
+        return self.output_connection.transport
 
-        if len(data) > 0:
-            logger.debug(
-                f'ProxyInputConnection {self.id}: {(self.sender_id, self.receiver_id)} '
-                f'received {len(data)} bytes'
-            )
-            self.recvbuf += data
-            self.recvbuf = self.hub_ref.process_buffer(
-                buffer=self.recvbuf,
-                transport=self.output_connection.transport,
-                connection=self
-            )
+    def is_output_ready(self) -> bool:
+        return self.output_ready.is_set()
 
+    async def wait_for_output(self):
+        self.received_data_before_init = True
+        logger.debug(
+            'ProxyInputConnection %s: Received data before being able '
+            'to handle it.',
+            self.id
+        )
+        await self.output_ready.wait()
 
-class ProxyOutputConnection(Protocol):
+        logger.debug(
+            'ProxyInputConnection %s: '
+            'Initialized output_connection & transport',
+            self.id
+        )
+        self.received_data_before_init = False
+
+
+class ProxyOutputConnection(ProxyConnection):
     """
     Represents connections made from proxies to the nodes they are representing,
     instances of this class are created when ProxyInputConnection's
@@ -542,23 +776,19 @@ class ProxyOutputConnection(Protocol):
     """
 
     def __init__(self, input_connection: ProxyInputConnection):
+        super().__init__(input_connection.hub_ref)
         self.input_connection = input_connection
-        self.hub_ref = input_connection.hub_ref
-        self.transport: Optional[Transport] = None
 
-        self.recvbuf = b''
         input_connection.output_connection = self
 
-        # Debugging related properties:
-        self.id = hex(id(self))
-
-        logger.debug(f'ProxyOutputConnection {self.id}: __init__')
+        logger.debug('ProxyOutputConnection %s: __init__', self.id)
 
     def connection_made(self, transport):
         self.transport = transport
 
         self.input_connection.transport.resume_reading()
         self.input_connection.resume_writing()
+        self.input_connection.output_ready.set()
 
         conn_key = (
             self.input_connection.sender_id, self.input_connection.receiver_id
@@ -568,14 +798,17 @@ class ProxyOutputConnection(Protocol):
         else:
             self.hub_ref.num_unexpected_connections += 1
             logger.debug(
-                f'ProxyOutputConnection {self.id}: connection_made '
-                ' (spontaneous connection)'
+                'ProxyOutputConnection %s: connection_made '
+                '(spontaneous connection)',
+                self.id
             )
 
-        logger.debug(f'''ProxyOutputConnection {self.id}: connection_made {(
+        logger.debug(
+            'ProxyOutputConnection %s: connection_made (%s, %s)',
+            self.id,
             self.input_connection.sender_id,
             self.input_connection.receiver_id
-        )}''')
+        )
 
     def connection_lost(self, exc):
         if self.transport is not None:
@@ -588,31 +821,27 @@ class ProxyOutputConnection(Protocol):
                 f'ProxyOutputConnection {self.id}: connection_lost (too early)'
             )
 
-        logger.debug(f'''ProxyOutputConnection {self.id}: connection_lost {(
+        logger.debug(
+            'ProxyOutputConnection %s: connection_lost (%s, %s)',
+            self.id,
             self.input_connection.sender_id,
             self.input_connection.receiver_id
-        )}''')
+        )
 
     def data_received(self, data):
-        self.hub_ref.loop.create_task(self.__handle_received_data(data))
+        logger.debug(
+            'ProxyOutputConnection %s: (%s, %s) received %d bytes',
+            self.id,
+            self.input_connection.sender_id,
+            self.input_connection.receiver_id,
+            len(data)
+        )
 
-    async def __handle_received_data(self, data):
-        receiver2sender_pair = (
+        delay = self.hub_ref.latency_policy.get_delay(
             self.input_connection.receiver_id, self.input_connection.sender_id
         )
 
-        await asyncio_sleep(self.hub_ref.latency_policy.get_delay(
-            *receiver2sender_pair
-        ))
+        self.relay_data(data, delay)
 
-        if len(data) > 0:
-            logger.debug(
-                f'ProxyOutputConnection {self.id}: {receiver2sender_pair[::-1]} '
-                f'received {len(data)} bytes'
-            )
-            self.recvbuf += data
-            self.recvbuf = self.hub_ref.process_buffer(
-                buffer=self.recvbuf,
-                transport=self.input_connection.transport,
-                connection=self
-            )
+    def get_output_transport(self) -> Transport:
+        return self.input_connection.transport
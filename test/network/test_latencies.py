@@ -5,6 +5,8 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 
+import pytest
+
 from network.latencies import (
     ExponentiallyDistributedLatencyPolicy,
     StaticLatencyPolicy
@@ -22,6 +24,13 @@ def test_static_latency_policy():
 
     assert (latency_policy.get_delay(3, 4) == 15)
     assert (latency_policy.get_delay(4, 3) == 12)
+    assert (latency_policy.get_delay(3, 5) == 42)
+    assert (latency_policy.get_delay(3, 3) == 42)
+    assert (latency_policy.get_delay(-1, 4) == 42)
+    assert (latency_policy.get_delay(4, -2) == 42)
+
+    with pytest.raises(ValueError):
+        latency_policy.set_delay(src_node=-1, dst_node=4, delay=10)
 
     latency_policy.set_delay(src_node=3, dst_node=4, delay=None)
     latency_policy.set_delay(src_node=4, dst_node=3, delay=None)
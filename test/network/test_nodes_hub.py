@@ -10,10 +10,12 @@ from asyncio import (
     AbstractServer,
     sleep as asyncio_sleep,
     Transport)
+from hashlib import sha256
 from logging import Logger
 from os import getpid
 from struct import pack
 from subprocess import Popen
+from typing import Any, List
 from unittest.mock import Mock, patch
 
 import pytest
@@ -24,10 +26,15 @@ from test_framework.test_node import TestNode as FakeNode
 
 from network.latencies import LatencyPolicy
 from network.utils import get_pid_for_network_server
-from network.stats import NetworkStatsCollector
+from network.stats import (
+    NetworkStatsCollector,
+    NullNetworkStatsCollector
+)
 from network.nodes_hub import (
+    MSG_HEADER_LENGTH,
     NodesHub,
     NUM_OUTBOUND_CONNECTIONS,
+    VERSION_PORT_OFFSET,
     ProxyInputConnection,
     ProxyOutputConnection
 )
@@ -54,6 +61,10 @@ def test_get_port_methods():
         assert(proxy_port not in used_ports)
         used_ports.add(proxy_port)
 
+        # The precomputed values are consistent with the getters
+        assert (node_port == nodes_hub.p2p_node_ports[node_id])
+        assert (f'127.0.0.1:{proxy_port}' == nodes_hub.get_proxy_address(node_id))
+
 
 def test_register_p2p_command():
     init_environment()
@@ -147,12 +158,11 @@ def test_process_buffer():
             network_stats_collector=Mock(spec=NetworkStatsCollector)
         )
 
-        connection_mock = Mock(spec=Transport)
-        connection_mock.id = 1234
+        connection_mock = get_connection_mock()
 
         # Incomplete messages are not processed, the buffer remains untouched
         assert (b'0123456789' == nodes_hub.process_buffer(
-            buffer=b'0123456789',  # Shorter than MSG_HEADER_LENGTH
+            buffer=bytearray(b'0123456789'),  # Shorter than MSG_HEADER_LENGTH
             transport=Mock(spec=Transport),
             connection=connection_mock
         ))
@@ -160,18 +170,79 @@ def test_process_buffer():
         # Processing 'verack' message
         buffer = (
             b'\x00\x00\x00\x00verack\x00\x00\x00\x00\x00\x00' +
-            pack('<i', 0)[:4] +  # Msg length (without the header)
+            pack('<I', 0)[:4] +  # Msg length (without the header)
             b'\x5d\xf6\xe0\xe2'  # Msg checksum
             b'123456'            # A little bit of noise
         )
         processed_buffer = nodes_hub.process_buffer(
-            buffer=buffer,
+            buffer=bytearray(buffer),
             transport=Mock(spec=Transport),
             connection=connection_mock
         )
         # The message is consumed, the next incomplete message remains unprocessed
         assert (b'123456' == processed_buffer)
 
+        # Messages without payload are processed as soon as they are complete
+        verack_msg = buffer[:MSG_HEADER_LENGTH]
+        transport_mock = Mock(spec=Transport)
+        assert (b'' == nodes_hub.process_buffer(
+            buffer=bytearray(verack_msg),
+            transport=transport_mock,
+            connection=connection_mock
+        ))
+        assert (verack_msg == get_written_data(transport_mock))
+
+        # The length of incomplete messages is remembered, so we don't parse
+        # their headers again until they are complete.
+        buffer = bytearray(
+            b'\x00\x00\x00\x00inv\x00\x00\x00\x00\x00\x00\x00\x00\x00' +
+            pack('<I', 100) +    # Msg length (without the header)
+            b'\x00\x00\x00\x00'  # Msg checksum
+            b'123456'            # Incomplete message body
+        )
+        assert (buffer is nodes_hub.process_buffer(
+            buffer=buffer,
+            transport=Mock(spec=Transport),
+            connection=connection_mock
+        ))
+        assert (MSG_HEADER_LENGTH + 100 == connection_mock.pending_msg_length)
+        buffer.extend(b'\x00' * 93)
+        with patch(
+            target='network.nodes_hub._HDR_COMMAND_AND_LEN'
+        ) as header_struct_mock:
+            assert (buffer is nodes_hub.process_buffer(
+                buffer=buffer,
+                transport=Mock(spec=Transport),
+                connection=connection_mock
+            ))
+            header_struct_mock.unpack_from.assert_not_called()
+        buffer.extend(b'\x00')
+        transport_mock = Mock(spec=Transport)
+        assert (b'' == nodes_hub.process_buffer(
+            buffer=buffer,
+            transport=transport_mock,
+            connection=connection_mock
+        ))
+        assert (buffer == get_written_data(transport_mock))
+        assert (0 == connection_mock.pending_msg_length)
+
+        # The length field is unsigned, so a malformed header can't make us
+        # move backwards (it's treated as a very long incomplete message).
+        buffer = bytearray(
+            b'\x00\x00\x00\x00inv\x00\x00\x00\x00\x00\x00\x00\x00\x00' +
+            b'\xff\xff\xff\xff' +  # Msg length (without the header)
+            b'\x00\x00\x00\x00'    # Msg checksum
+        )
+        transport_mock = Mock(spec=Transport)
+        assert (buffer is nodes_hub.process_buffer(
+            buffer=buffer,
+            transport=transport_mock,
+            connection=connection_mock
+        ))
+        assert (MSG_HEADER_LENGTH + 0xffffffff == connection_mock.pending_msg_length)
+        assert (b'' == get_written_data(transport_mock))
+        connection_mock.pending_msg_length = 0
+
         # Processing 'version' message
         buffer = (
             # Message Header
@@ -189,14 +260,256 @@ def test_process_buffer():
         )
         transport_mock = Mock(spec=Transport)
         processed_buffer = nodes_hub.process_buffer(
-            buffer=buffer,
+            buffer=bytearray(buffer),
             transport=transport_mock,
             connection=connection_mock
         )
         assert (b'' == processed_buffer)
         # The node is not listening connections, so it specifies port 0, hence we
         # we pass the original message without any changes.
-        transport_mock.write.assert_called_once_with(buffer)
+        transport_mock.writelines.assert_called_once()
+        assert (buffer == get_written_data(transport_mock))
+
+
+def test_process_buffer_rewrites_version_port():
+    init_environment()
+
+    with patch(
+        target='network.nodes_hub.NodesHub.register_p2p_command',
+        new=CoroutineMock(spec=NodesHub.register_p2p_command)
+    ):
+        nodes_hub = NodesHub(
+            loop=Mock(spec=AbstractEventLoop),
+            latency_policy=Mock(spec=LatencyPolicy),
+            nodes=[get_node_mock(node_id) for node_id in range(5)],
+            network_stats_collector=Mock(spec=NetworkStatsCollector)
+        )
+        nodes_hub.ports2nodes_map[
+            nodes_hub.get_p2p_node_port(2) - nodes_hub.ports_base
+        ] = 2
+
+        connection_mock = get_connection_mock()
+
+        node_port = nodes_hub.get_p2p_node_port(2)
+        proxy_port = nodes_hub.get_p2p_proxy_port(2)
+
+        verack_msg = build_message(b'verack', b'')
+        buffer = (
+            build_message(b'version', build_version_payload(node_port)) +
+            verack_msg +
+            verack_msg[:10]  # Incomplete message
+        )
+
+        # Received data can be processed directly (bytes, read-only) or after
+        # being copied into the connection's buffer (bytearray).
+        for input_buffer in (buffer, bytearray(buffer)):
+            connection_mock.version_relayed = False
+            transport_mock = Mock(spec=Transport)
+            processed_buffer = nodes_hub.process_buffer(
+                buffer=input_buffer,
+                transport=transport_mock,
+                connection=connection_mock
+            )
+
+            # Only the incomplete message remains in the buffer
+            assert (verack_msg[:10] == processed_buffer)
+            assert (isinstance(processed_buffer, bytearray))
+
+            # All the processed messages are sent at once
+            transport_mock.writelines.assert_called_once()
+
+            # The port is replaced by the proxy's port, and the checksum is updated
+            assert (get_written_data(transport_mock) == (
+                build_message(b'version', build_version_payload(proxy_port)) +
+                verack_msg
+            ))
+
+            # We keep parsing messages because we have to collect stats
+            assert (connection_mock.version_relayed)
+            assert (not connection_mock.relay_raw_data)
+
+
+def test_process_buffer_keeps_version_with_unknown_port():
+    init_environment()
+
+    with patch(
+        target='network.nodes_hub.NodesHub.register_p2p_command',
+        new=CoroutineMock(spec=NodesHub.register_p2p_command)
+    ):
+        nodes_hub = NodesHub(
+            loop=Mock(spec=AbstractEventLoop),
+            latency_policy=Mock(spec=LatencyPolicy),
+            nodes=[get_node_mock(node_id) for node_id in range(5)],
+            network_stats_collector=Mock(spec=NetworkStatsCollector)
+        )
+
+        connection_mock = get_connection_mock()
+
+        unknown_ports = [
+            nodes_hub.ports_base - 1,  # Out of range
+            nodes_hub.ports_base + len(nodes_hub.ports2nodes_map),  # Out of range
+            nodes_hub.get_p2p_node_port(2),  # Proxies not started, mapped to -1
+        ]
+        for node_port in unknown_ports:
+            connection_mock.version_relayed = False
+            transport_mock = Mock(spec=Transport)
+            buffer = build_message(b'version', build_version_payload(node_port))
+
+            processed_buffer = nodes_hub.process_buffer(
+                buffer=bytearray(buffer),
+                transport=transport_mock,
+                connection=connection_mock
+            )
+
+            # The message is relayed without changes
+            assert (bytearray() == processed_buffer)
+            assert (buffer == get_written_data(transport_mock))
+            assert (connection_mock.version_relayed)
+
+
+def test_process_buffer_stops_parsing_after_version():
+    init_environment()
+
+    nodes_hub = NodesHub(
+        loop=Mock(spec=AbstractEventLoop),
+        latency_policy=Mock(spec=LatencyPolicy),
+        nodes=[get_node_mock(node_id) for node_id in range(5)],
+        network_stats_collector=NullNetworkStatsCollector()
+    )
+
+    connection_mock = get_connection_mock()
+
+    version_msg = build_message(b'version', build_version_payload(0))
+    verack_msg = build_message(b'verack', b'')
+
+    # While there's an incomplete message in the buffer, we keep parsing
+    nodes_hub.process_buffer(
+        buffer=bytearray(version_msg + verack_msg[:10]),
+        transport=Mock(spec=Transport),
+        connection=connection_mock
+    )
+    assert (connection_mock.version_relayed)
+    assert (not connection_mock.relay_raw_data)
+
+    nodes_hub.process_buffer(
+        buffer=bytearray(verack_msg),
+        transport=Mock(spec=Transport),
+        connection=connection_mock
+    )
+    assert (connection_mock.relay_raw_data)
+
+
+def test_output_connection_data_received():
+    hub_mock = get_hub_mock(loop=Mock(spec=AbstractEventLoop), relayed_data=[])
+    hub_mock.loop.time.return_value = 100.0
+
+    input_connection_mock = get_input_connection_mock(hub_mock)
+
+    output_connection = ProxyOutputConnection(
+        input_connection=input_connection_mock
+    )
+
+    # Without delay, data is processed right away
+    output_connection.data_received(b'abc')  # SUT
+    assert (1 == hub_mock.process_buffer.call_count)
+    hub_mock.loop.create_task.assert_not_called()
+
+    # With delay, data is processed later
+    hub_mock.latency_policy.get_delay.return_value = 0.1
+    output_connection.data_received(b'def')  # SUT
+    assert (1 == hub_mock.process_buffer.call_count)
+    assert (1 == hub_mock.loop.create_task.call_count)
+
+    # While there are pending chunks, new ones can't skip the queue, and they
+    # are handled by the same task.
+    hub_mock.latency_policy.get_delay.return_value = 0
+    output_connection.data_received(b'ghi')  # SUT
+    assert (1 == hub_mock.process_buffer.call_count)
+    assert (1 == hub_mock.loop.create_task.call_count)
+    assert (
+        [(100.1, b'def'), (100.1, b'ghi')] == list(output_connection.pending_chunks)
+    )
+
+    hub_mock.loop.create_task.call_args[0][0].close()  # Avoids warnings
+    output_connection.pending_chunks.clear()
+
+    # Once the handshake is done (and if we don't collect stats), data is
+    # relayed without parsing it
+    output_connection.relay_raw_data = True
+    output_connection.data_received(b'jkl')  # SUT
+    assert (1 == hub_mock.process_buffer.call_count)
+    input_connection_mock.transport.writelines.assert_called_once_with((b'jkl',))
+
+
+@pytest.mark.asyncio
+async def test_output_connection_relays_in_order(event_loop: AbstractEventLoop):
+    relayed_data: List[bytes] = []
+    hub_mock = get_hub_mock(loop=event_loop, relayed_data=relayed_data)
+
+    input_connection_mock = get_input_connection_mock(hub_mock)
+
+    output_connection = ProxyOutputConnection(
+        input_connection=input_connection_mock
+    )
+
+    # The second chunk has a shorter delay, but it can't overtake the first one
+    hub_mock.latency_policy.get_delay.return_value = 0.02
+    output_connection.data_received(b'abc')  # SUT
+    hub_mock.latency_policy.get_delay.return_value = 0.01
+    output_connection.data_received(b'def')  # SUT
+    hub_mock.latency_policy.get_delay.return_value = 0
+    output_connection.data_received(b'ghi')  # SUT
+
+    assert ([] == relayed_data)
+    relay_task = output_connection.relay_task
+    assert (relay_task is not None)
+    await relay_task
+
+    # All the chunks are processed at once, keeping their order
+    assert ([b'abcdefghi'] == relayed_data)
+    assert (output_connection.relay_task is None)
+
+
+@pytest.mark.asyncio
+async def test_input_connection_waits_for_output(event_loop: AbstractEventLoop):
+    relayed_data: List[bytes] = []
+    hub_mock = get_hub_mock(loop=event_loop, relayed_data=relayed_data)
+
+    input_connection = ProxyInputConnection(hub_ref=hub_mock, node_id=2)
+    input_connection.sender_id = 1
+    input_connection.output_connection = Mock(spec=ProxyOutputConnection)
+    input_connection.output_connection.transport = Mock(spec=Transport)
+
+    # Data can arrive before the output connection is ready, even without delay
+    input_connection.data_received(b'abc')  # SUT
+    input_connection.data_received(b'def')  # SUT
+    for _ in range(10):
+        await asyncio_sleep(0)  # Switching context
+
+    assert ([] == relayed_data)
+    assert (input_connection.received_data_before_init)
+    relay_task = input_connection.relay_task
+    assert (relay_task is not None and not relay_task.done())
+
+    # Once it's ready, the pending chunks are relayed at once, keeping their order
+    input_connection.output_ready.set()
+    await relay_task
+    assert ([b'abcdef'] == relayed_data)
+    assert (not input_connection.received_data_before_init)
+    assert (input_connection.relay_task is None)
+
+    # From now on, data without delay is processed right away
+    input_connection.data_received(b'ghi')  # SUT
+    assert ([b'abcdef', b'ghi'] == relayed_data)
+    assert (input_connection.relay_task is None)
+
+    # And it's relayed without parsing it once the handshake is done
+    input_connection.relay_raw_data = True
+    input_connection.data_received(b'jkl')  # SUT
+    assert ([b'abcdef', b'ghi'] == relayed_data)
+    input_connection.output_connection.transport.writelines.assert_called_once_with(
+        (b'jkl',)
+    )
 
 
 @pytest.mark.asyncio
@@ -227,6 +540,76 @@ async def test_start_proxies(event_loop: AbstractEventLoop):
     nodes_hub.close()
 
 
+@pytest.mark.asyncio
+async def test_connect_nodes_waits_for_proxies(event_loop: AbstractEventLoop):
+    init_environment()
+
+    connected_pairs = []
+
+    async def fake_connect_sender_to_proxy(_self, outbound_idx, inbound_idx):
+        connected_pairs.append((outbound_idx, inbound_idx))
+
+    with patch(
+        target='network.nodes_hub.NodesHub.connect_sender_to_proxy',
+        new=fake_connect_sender_to_proxy
+    ):
+        nodes_hub = NodesHub(
+            loop=event_loop,
+            latency_policy=Mock(spec=LatencyPolicy),
+            nodes=[get_node_mock(node_id) for node_id in range(5)],
+            network_stats_collector=Mock(spec=NetworkStatsCollector)
+        )
+
+        connect_task = event_loop.create_task(nodes_hub.connect_nodes(0, 1))  # SUT
+        for _ in range(10):
+            await asyncio_sleep(0)  # Switching context
+
+        # Blocked because the proxies are not listening yet
+        assert (not connect_task.done())
+        assert (0 == len(connected_pairs))
+
+        await nodes_hub.start_proxies()
+        await connect_task
+        assert ([(0, 1)] == connected_pairs)
+
+        nodes_hub.close()
+
+
+@pytest.mark.asyncio
+async def test_connect_sender_to_proxy(event_loop: AbstractEventLoop):
+    init_environment()
+
+    # Not List[Mock], as NodesHub expects a List[TestNode]
+    nodes: List[Any] = [get_node_mock(node_id) for node_id in range(5)]
+    for node in nodes:
+        node.addnode = Mock()
+
+    nodes_hub = NodesHub(
+        loop=event_loop,
+        latency_policy=Mock(spec=LatencyPolicy),
+        nodes=nodes,
+        network_stats_collector=Mock(spec=NetworkStatsCollector)
+    )
+
+    # The first time we add the proxy to the sender's list
+    await nodes_hub.connect_sender_to_proxy(0, 1)  # SUT
+    proxy_address = nodes_hub.get_proxy_address(1)
+    assert (
+        [((proxy_address, 'add'),), ((proxy_address, 'onetry'),)] ==
+        nodes[0].addnode.call_args_list
+    )
+    assert ({(0, 1)} == nodes_hub.pending_connections)
+    assert (1 == nodes_hub.num_connection_intents)
+
+    # Retries don't add the proxy again
+    nodes[0].addnode.reset_mock()
+    await nodes_hub.connect_sender_to_proxy(0, 1)  # SUT
+    nodes[0].addnode.assert_called_once_with(proxy_address, 'onetry')
+    assert (1 == nodes_hub.num_connection_intents)
+
+    nodes_hub.close()
+
+
 @pytest.mark.asyncio
 async def test_wait_for_pending_connections(event_loop: AbstractEventLoop):
     init_environment()
@@ -349,3 +732,70 @@ def get_node_mock(node_id: int) -> Mock:
     test_node.process.pid = node_id + 1000
 
     return test_node
+
+
+def get_hub_mock(loop: AbstractEventLoop, relayed_data: List[bytes]) -> Mock:
+    # process_buffer consumes the whole buffer, and keeps a copy in relayed_data
+    def fake_process_buffer(buffer, transport, connection):
+        relayed_data.append(bytes(buffer))
+        return bytearray()
+
+    hub_mock = Mock(spec=NodesHub)
+    hub_mock.loop = loop
+    hub_mock.latency_policy = Mock(spec=LatencyPolicy)
+    hub_mock.latency_policy.get_delay.return_value = 0
+    hub_mock.process_buffer.side_effect = fake_process_buffer
+
+    return hub_mock
+
+
+def get_input_connection_mock(hub_mock: Mock) -> Mock:
+    input_connection_mock = Mock(spec=ProxyInputConnection)
+    input_connection_mock.hub_ref = hub_mock
+    input_connection_mock.sender_id = 1
+    input_connection_mock.receiver_id = 2
+    input_connection_mock.transport = Mock(spec=Transport)
+
+    return input_connection_mock
+
+
+def get_connection_mock() -> Mock:
+    connection_mock = Mock(spec=ProxyInputConnection)
+    connection_mock.id = 1234
+    connection_mock.sender_id = 1
+    connection_mock.receiver_id = 2
+    connection_mock.pending_msg_length = 0
+    connection_mock.version_relayed = False
+    connection_mock.relay_raw_data = False
+
+    return connection_mock
+
+
+def build_version_payload(port: int) -> bytes:
+    return (
+        b'\x7f\x11\x01\x00' +
+        b'\x00' * (VERSION_PORT_OFFSET - 4) +
+        pack('!H', port) +
+        b'\x00' * 8 +
+        b'/Feuerland:0.16.3(testnode25)/\x00\x00\x00\x00\x01'
+    )
+
+
+def build_message(command: bytes, payload: bytes) -> bytes:
+    return (
+        b'\xfa\xbf\xb5\xda' +
+        command + b'\x00' * (12 - len(command)) +
+        pack('<I', len(payload)) +
+        sha256(sha256(payload).digest()).digest()[:4] +
+        payload
+    )
+
+
+def get_written_data(transport_mock: Mock) -> bytes:
+    written_data = b''
+    for name, args, _ in transport_mock.method_calls:
+        if 'write' == name:
+            written_data += bytes(args[0])
+        elif 'writelines' == name:
+            written_data += b''.join(bytes(chunk) for chunk in args[0])
+    return written_data